@@ -7,47 +7,134 @@ SRC = os.path.join(ROOT, "src")
 if SRC not in sys.path:
     sys.path.insert(0, SRC)
 
-from mcp_twotruths.storage import TableStorage  # type: ignore
+from mcp_twotruths.storage import SCHEMA_V1, SCHEMA_V2, TableStorage  # type: ignore
+from mcp_twotruths.tournament import TournamentRunner  # type: ignore
 
 
-def main():
-    print("Using AzureWebJobsStorage:", bool(os.getenv("AzureWebJobsStorage")))
-    store = TableStorage()
+HOST = "host@example.com"
+U1 = ("alice@example.com", "Alice")
+U2 = ("bob@example.com", "Bob")
 
-    host = "host@example.com"
-    u1 = ("alice@example.com", "Alice")
-    u2 = ("bob@example.com", "Bob")
 
-    store.upsert_user(*u1)
-    store.upsert_user(*u2)
+def play_round(store: TableStorage, session: str) -> None:
+    store.upsert_statements(session, U1[0], "I love cats", "I ran a marathon", "I've been to Mars", U1[1])
+    store.upsert_statements(session, U2[0], "I play guitar", "I speak 4 languages", "I can fly unaided", U2[1])
 
-    session = store.create_session(host)
-    print("Session:", session)
-
-    store.upsert_statements(session, u1[0], "I love cats", "I ran a marathon", "I've been to Mars", u1[1])
-    store.upsert_statements(session, u2[0], "I play guitar", "I speak 4 languages", "I can fly unaided", u2[1])
-
-    pr1 = store.create_presentation(session, u1[0])
-    pr2 = store.create_presentation(session, u2[0])
+    pr1 = store.create_presentation(session, U1[0])
+    pr2 = store.create_presentation(session, U2[0])
     print("Presentation 1:")
     pprint(pr1)
     print("Presentation 2:")
     pprint(pr2)
 
-    # Bob guesses Alice's lie is index 3
-    store.cast_vote(session, voter_email=u2[0], target_email=u1[0], chosen_index=3)
-    # Alice guesses Bob's lie is index 3
-    store.cast_vote(session, voter_email=u1[0], target_email=u2[0], chosen_index=3)
+    # Bob finds Alice's lie; Alice guesses Bob's lie is index 3
+    store.cast_vote(session, voter_email=U2[0], target_email=U1[0], chosen_index=int(pr1["lieIndex"]))
+    store.cast_vote(session, voter_email=U1[0], target_email=U2[0], chosen_index=3)
 
-    tally1 = store.tally_target(session, u1[0])
-    tally2 = store.tally_target(session, u2[0])
+    tally1 = store.tally_target(session, U1[0])
+    tally2 = store.tally_target(session, U2[0])
     print("Tally for Alice:")
     pprint(tally1)
     print("Tally for Bob:")
     pprint(tally2)
 
-    print("Scores:")
-    pprint(store.list_scores(session))
+
+def check_session(store: TableStorage, session: str, version: int) -> None:
+    assert store.get_schema_version(session) == version, "unexpected schema version"
+    statements = store.list_statements(session)
+    assert sorted(s["email"] for s in statements) == [U1[0], U2[0]], statements
+    assert all(set(s) <= {"PartitionKey", "RowKey", "email", "alias", "truth1", "truth2", "lie1"} for s in statements)
+
+    scores = {s["email"]: int(s["score"]) for s in store.list_scores(session)}
+    expected = {U2[0]: 1}
+    if store.get_presentation(session, U2[0])["lieIndex"] == 3:
+        expected[U1[0]] = 1
+    assert scores == expected, scores
+    assert all(set(s) <= {"PartitionKey", "RowKey", "email", "score"} for s in store.list_scores(session))
+    assert store.get_score(session, U2[0]) == 1
+    print(f"Scores (schema v{version}):")
+    pprint(scores)
+
+
+def main():
+    print("Using AzureWebJobsStorage:", bool(os.getenv("AzureWebJobsStorage")))
+    store = TableStorage()
+
+    store.upsert_user(*U1)
+    store.upsert_user(*U2)
+
+    sessions = []
+    for version in (SCHEMA_V1, SCHEMA_V2):
+        session = store.create_session(HOST, version)
+        print(f"Session (schema v{version}):", session)
+        sessions.append(session)
+        play_round(store, session)
+        check_session(store, session, version)
+        # Tallies only credit the difference, so re-running them leaves scores alone
+        store.tally_target(session, U1[0])
+        store.tally_target(session, U2[0])
+        check_session(store, session, version)
+
+    # Migrate the v1 session; other stores stand in for other processes reading it
+    migrated = sessions[0]
+    other = TableStorage()
+    assert other.get_schema_version(migrated) == SCHEMA_V1
+    pprint(store.migrate_session(migrated))
+    # other keeps its cached v1 answer for SCHEMA_CACHE_TTL; a fresh process sees v2
+    assert other.get_schema_version(migrated) == SCHEMA_V1
+    later = TableStorage()
+    check_session(later, migrated, SCHEMA_V2)
+    store.tally_target(migrated, U1[0])
+    check_session(later, migrated, SCHEMA_V2)
+    later.upsert_statements(migrated, U1[0], "I love dogs", "I ran a marathon", "I've been to Mars", U1[1])
+    assert store.get_statements(migrated, U1[0])["truth1"] == "I love dogs"
+
+    for session in sessions:
+        store.delete_session(session)
+
+    run_tournament(store)
+    print("OK")
+
+
+def run_tournament(store: TableStorage) -> None:
+    runner = TournamentRunner(store, max_workers=2)
+    created = runner.create(HOST, 2, SCHEMA_V2)
+    assert not created["errors"], created["errors"]
+    tournament, rooms = created["tournamentId"], created["rooms"]
+    print("Tournament:", tournament)
+
+    try:
+        runner.set_status(tournament, "final")
+        raise AssertionError("invalid room status accepted")
+    except ValueError:
+        pass
+    assert runner.set_status(tournament, "voting")["updated"] == 2
+    for room in rooms:
+        play_round(store, room)
+    scores_before = [store.list_scores(room) for room in rooms]
+
+    # Rooms were already tallied per target; tournament tallies must not count them again
+    runner.tally(tournament)
+    tallied = runner.tally(tournament)
+    assert not tallied["errors"], tallied["errors"]
+    assert all(r["tallied"] == 2 for r in tallied["rooms"])
+    collected = runner.collect_winners(tournament)
+    assert not collected["errors"], collected["errors"]
+    assert [store.list_scores(room) for room in rooms] == scores_before
+    assert all(U2[0] in r["winners"] for r in collected["rooms"])
+
+    final = runner.create_final(tournament)
+    assert U2[0] in final["finalists"]
+    try:
+        runner.create_final(tournament)
+        raise AssertionError("second final session created")
+    except ValueError:
+        pass
+    print("Bracket:")
+    pprint(runner.bracket(tournament))
+
+    for session in rooms + [final["finalSessionId"], tournament]:
+        store.delete_session(session)
 
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ from typing import Dict, List
 from mcp.server.fastmcp import FastMCP
 
 from .storage import TableStorage
+from .tournament import ROOM_STATUSES, TournamentRunner
 
 
 IDEAL_SYSTEM_PROMPT = (
@@ -17,6 +18,7 @@ IDEAL_SYSTEM_PROMPT = (
 
 def create_server(port: int | None = None) -> FastMCP:
     storage = TableStorage()
+    tournaments = TournamentRunner(storage)
     # Configure stateless HTTP transport per BYO Functions guidance
     kwargs = {}
     if port is not None:
@@ -30,10 +32,17 @@ def create_server(port: int | None = None) -> FastMCP:
         return {"email": email.lower(), "alias": alias}
 
     @mcp.tool()
-    async def tt_create_session(host_email: str) -> Dict:
-        """Create a new session and return the session id."""
-        session_id = storage.create_session(host_email)
-        return {"sessionId": session_id, "status": "collecting"}
+    async def tt_create_session(host_email: str, schema_version: int = 1) -> Dict:
+        """Create a new session and return the session id. schema_version=2 uses one row per player."""
+        if schema_version not in (1, 2):
+            return {"ok": False, "error": "schema_version must be 1 or 2"}
+        session_id = storage.create_session(host_email, schema_version)
+        return {"sessionId": session_id, "status": "collecting", "schemaVersion": schema_version}
+
+    @mcp.tool()
+    async def tt_migrate_session(session_id: str) -> Dict:
+        """Convert a session to the consolidated per-player layout (schema version 2)."""
+        return storage.migrate_session(session_id)
 
     @mcp.tool()
     async def tt_set_session_status(session_id: str, status: str) -> Dict:
@@ -94,4 +103,41 @@ def create_server(port: int | None = None) -> FastMCP:
         """List all users' scores for a session."""
         return storage.list_scores(session_id)
 
+    # Tournament tools run room fan-out on worker threads to keep the event loop responsive
+    @mcp.tool()
+    async def tt_create_tournament(host_email: str, room_count: int, schema_version: int = 1) -> Dict:
+        """Create a tournament with room_count concurrent sessions (rooms)."""
+        if not 1 <= room_count <= 500:
+            return {"ok": False, "error": "room_count must be between 1 and 500"}
+        if schema_version not in (1, 2):
+            return {"ok": False, "error": "schema_version must be 1 or 2"}
+        return await asyncio.to_thread(tournaments.create, host_email, room_count, schema_version)
+
+    @mcp.tool()
+    async def tt_set_tournament_status(tournament_id: str, status: str) -> Dict:
+        """Update every room's status: collecting|voting|reveal|ended."""
+        if status not in ROOM_STATUSES:
+            return {"ok": False, "error": "status must be collecting, voting, reveal, or ended"}
+        return await asyncio.to_thread(tournaments.set_status, tournament_id, status)
+
+    @mcp.tool()
+    async def tt_tally_tournament(tournament_id: str) -> Dict:
+        """Tally all presented targets in every room and record each room's winners. Safe to re-run."""
+        return await asyncio.to_thread(tournaments.tally, tournament_id)
+
+    @mcp.tool()
+    async def tt_collect_tournament_winners(tournament_id: str) -> Dict:
+        """Record each room's winners from its scores, for rooms already tallied with tt_tally_target."""
+        return await asyncio.to_thread(tournaments.collect_winners, tournament_id)
+
+    @mcp.tool()
+    async def tt_create_tournament_final(tournament_id: str) -> Dict:
+        """Create the final session for all room winners and return the finalists."""
+        return await asyncio.to_thread(tournaments.create_final, tournament_id)
+
+    @mcp.tool()
+    async def tt_get_tournament_bracket(tournament_id: str) -> Dict:
+        """Return rooms with their winners and the final session's scores."""
+        return await asyncio.to_thread(tournaments.bracket, tournament_id)
+
     return mcp
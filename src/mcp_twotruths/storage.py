@@ -1,12 +1,27 @@
 from __future__ import annotations
 
 import os
+import time
 import uuid
+from itertools import permutations
 from typing import Dict, List, Optional, Tuple
 import random
 
+from azure.core import MatchConditions
 from azure.core.credentials import AzureNamedKeyCredential
-from azure.data.tables import TableClient
+from azure.core.exceptions import ResourceModifiedError
+from azure.data.tables import TableClient, UpdateMode
+
+
+# Session schema versions (stored as "schemaVersion" on the session meta row)
+SCHEMA_V1 = 1  # separate st:/pr:/sc: rows per player
+SCHEMA_V2 = 2  # one consolidated pl: row per player
+# Seconds a v1 answer is trusted before meta is re-read (migration can flip it to v2)
+SCHEMA_CACHE_TTL = 30.0
+
+STATEMENT_KINDS = ("truth1", "truth2", "lie1")
+# Presentation orders are stored in v2 as an index into this list
+PRESENTATION_PERMUTATIONS: List[Tuple[str, ...]] = list(permutations(STATEMENT_KINDS))
 
 
 class TableStorage:
@@ -19,6 +34,18 @@ class TableStorage:
     - Votes: PartitionKey=sessionId, RowKey=f"vt:{voterEmail}:{targetEmail}"
       - Scores: PartitionKey=sessionId, RowKey=f"sc:{email}"
     - Presentations: PartitionKey=sessionId, RowKey=f"pr:{targetEmail}"
+      - Players (schema v2): PartitionKey=sessionId, RowKey=f"pl:{email}"
+      - Tournaments: PartitionKey=tournamentId, RowKey="tournament"
+      - Tournament rooms: PartitionKey=tournamentId, RowKey=f"rm:{sessionId}"
+
+    Sessions created with schema_version=2 keep each player's statements, presentation
+    permutation ("perm"), score and received-vote histogram ("h1".."h3") in a single pl: row.
+    The histogram is a snapshot written by tally_target; it is absent or stale until the
+    target is tallied. Sessions created as v2 only ever read pl: rows. Migrated sessions
+    (meta "legacyRows") merge per player: pl: fields win and legacy rows fill the gaps.
+
+    tally_target records the voters it credited on the presentation (pr: or pl: row,
+    "credited"), so re-running it only applies the difference to scores.
     """
 
     def __init__(self, table_name: str = "twotruths") -> None:
@@ -31,6 +58,9 @@ class TableStorage:
         except Exception:
             # table may already exist
             pass
+        # sessionId -> (schemaVersion, legacyRows, expiry). v2 never expires: migration only
+        # goes v1 -> v2; v1 is re-checked after SCHEMA_CACHE_TTL in case another process migrated
+        self._layouts: Dict[str, Tuple[int, bool, float]] = {}
 
     # Users
     def upsert_user(self, email: str, alias: str) -> None:
@@ -48,15 +78,19 @@ class TableStorage:
             return None
 
     # Sessions
-    def create_session(self, host_email: str) -> str:
+    def create_session(self, host_email: str, schema_version: int = SCHEMA_V1) -> str:
+        if schema_version not in (SCHEMA_V1, SCHEMA_V2):
+            raise ValueError(f"Unsupported schema version: {schema_version}")
         session_id = str(uuid.uuid4())
         entity = {
             "PartitionKey": session_id,
             "RowKey": "meta",
             "host": host_email.lower(),
             "status": "collecting",
+            "schemaVersion": int(schema_version),
         }
         self._client.upsert_entity(entity)
+        self._cache_layout(session_id, int(schema_version), False)
         return session_id
 
     def set_session_status(self, session_id: str, status: str) -> None:
@@ -70,6 +104,28 @@ class TableStorage:
         except Exception:
             return None
 
+    def _cache_layout(self, session_id: str, version: int, legacy: bool) -> None:
+        expiry = float("inf") if version == SCHEMA_V2 else time.monotonic() + SCHEMA_CACHE_TTL
+        self._layouts[session_id] = (version, legacy, expiry)
+
+    def _layout(self, session_id: str) -> Tuple[int, bool]:
+        """(schemaVersion, legacyRows) for a session; looked up once per public operation."""
+        cached = self._layouts.get(session_id)
+        if cached and cached[2] > time.monotonic():
+            return cached[0], cached[1]
+        meta = self.get_session(session_id)
+        if not meta:
+            # unknown session: don't cache, it may be created later
+            return SCHEMA_V1, True
+        version = int(meta.get("schemaVersion", SCHEMA_V1))
+        legacy = version == SCHEMA_V1 or bool(meta.get("legacyRows", False))
+        self._cache_layout(session_id, version, legacy)
+        return version, legacy
+
+    def get_schema_version(self, session_id: str) -> int:
+        """Return the session's schema version; sessions without the flag are v1."""
+        return self._layout(session_id)[0]
+
     def list_sessions(self) -> List[Dict]:
         """List all sessions by querying meta rows across partitions."""
         # Query all rows with RowKey == 'meta' to discover sessions
@@ -93,10 +149,193 @@ class TableStorage:
                 deleted += 1
             except Exception as e:
                 errors.append(f"{rk}: {e}")
+        self._layouts.pop(session_id, None)
         return {"sessionId": session_id, "deleted": deleted, "errors": errors}
 
+    def migrate_session(self, session_id: str) -> Dict:
+        """
+        Fold a v1 session's st:/pr:/sc: rows and votes into consolidated pl: rows and flag
+        the session as v2. Legacy rows are left in place (delete_session still removes them).
+        Run it while the session is idle, and keep it idle for SCHEMA_CACHE_TTL seconds:
+        other processes may keep writing legacy rows until their cached v1 answer expires,
+        and those writes are shadowed by the pl: values written here.
+        """
+        meta = self._client.get_entity(session_id, "meta")
+        if int(meta.get("schemaVersion", SCHEMA_V1)) == SCHEMA_V2:
+            return {"sessionId": session_id, "migrated": 0, "schemaVersion": SCHEMA_V2}
+
+        players: Dict[str, Dict] = {}
+
+        def player(email: str) -> Dict:
+            email = email.lower()
+            if email not in players:
+                players[email] = {"PartitionKey": session_id, "RowKey": f"pl:{email}", "email": email}
+            return players[email]
+
+        for st in self._list_prefix(session_id, "st:"):
+            ent = player(st.get("email") or st["RowKey"][3:])
+            ent["alias"] = st.get("alias", "")
+            for kind in STATEMENT_KINDS:
+                ent[kind] = st.get(kind, "")
+        for pr in self._list_prefix(session_id, "pr:"):
+            kinds = tuple(k for k in (pr.get("order") or "").split(",") if k)
+            if kinds in PRESENTATION_PERMUTATIONS:
+                ent = player(pr.get("target") or pr["RowKey"][3:])
+                ent["perm"] = PRESENTATION_PERMUTATIONS.index(kinds)
+                if pr.get("credited") is not None:
+                    ent["credited"] = pr["credited"]
+        for sc in self._list_prefix(session_id, "sc:"):
+            player(sc.get("email") or sc["RowKey"][3:])["score"] = int(sc.get("score", 0))
+        for vt in self._list_prefix(session_id, "vt:"):
+            choice = int(vt.get("choice", 0))
+            target = vt.get("target") or ""
+            if target and choice in (1, 2, 3):
+                ent = player(target)
+                ent[f"h{choice}"] = int(ent.get(f"h{choice}", 0)) + 1
+
+        for ent in players.values():
+            self._client.upsert_entity(ent)
+        meta["schemaVersion"] = SCHEMA_V2
+        meta["legacyRows"] = True
+        self._client.upsert_entity(meta)
+        self._cache_layout(session_id, SCHEMA_V2, True)
+        return {"sessionId": session_id, "migrated": len(players), "schemaVersion": SCHEMA_V2}
+
+    # Players (schema v2)
+    def _list_prefix(self, session_id: str, prefix: str) -> List[Dict]:
+        # RowKey prefixes all end in ':'; ';' is the next character, closing the range
+        return list(
+            self._client.query_entities(
+                f"PartitionKey eq '{session_id}' and RowKey ge '{prefix}' and RowKey lt '{prefix[:-1]};'"
+            )
+        )
+
+    def get_player(self, session_id: str, email: str) -> Optional[Dict]:
+        try:
+            return self._client.get_entity(session_id, f"pl:{email.lower()}")
+        except Exception:
+            return None
+
+    def list_players(self, session_id: str) -> List[Dict]:
+        return self._list_prefix(session_id, "pl:")
+
+    def _merge_player(self, session_id: str, email: str, fields: Dict) -> None:
+        entity = {
+            "PartitionKey": session_id,
+            "RowKey": f"pl:{email.lower()}",
+            "email": email.lower(),
+            **fields,
+        }
+        # upsert defaults to merge, so other per-player fields are preserved
+        self._client.upsert_entity(entity)
+
+    def _merged_rows(self, session_id: str, legacy_prefix: str, field: str, legacy: bool) -> List[Dict]:
+        """pl: rows that carry field, merged per player over legacy rows (pl: wins) when legacy is set."""
+        merged: Dict[str, Dict] = {}
+        if legacy:
+            for ent in self._list_prefix(session_id, legacy_prefix):
+                email = (ent.get("email") or ent["RowKey"][3:]).lower()
+                merged[email] = ent
+        for ent in self.list_players(session_id):
+            if ent.get(field) is not None:
+                merged[ent["email"]] = ent
+        return list(merged.values())
+
+    @staticmethod
+    def _statements_from_player(ent: Dict) -> Dict:
+        return {
+            "PartitionKey": ent["PartitionKey"],
+            "RowKey": f"st:{ent['email']}",
+            "email": ent["email"],
+            "alias": ent.get("alias", ""),
+            **{kind: ent.get(kind, "") for kind in STATEMENT_KINDS},
+        }
+
+    @staticmethod
+    def _score_from_player(ent: Dict) -> Dict:
+        return {
+            "PartitionKey": ent["PartitionKey"],
+            "RowKey": f"sc:{ent['email']}",
+            "email": ent["email"],
+            "score": int(ent.get("score", 0)),
+        }
+
+    @staticmethod
+    def _presentation_from_player(ent: Dict) -> Optional[Dict]:
+        if ent.get("perm") is None:
+            return None
+        kinds = PRESENTATION_PERMUTATIONS[int(ent["perm"])]
+        pr = {
+            "PartitionKey": ent["PartitionKey"],
+            "RowKey": f"pr:{ent['email']}",
+            "target": ent["email"],
+            "order": ",".join(kinds),
+            "lieIndex": kinds.index("lie1") + 1,
+        }
+        if ent.get("credited") is not None:
+            pr["credited"] = ent["credited"]
+        return pr
+
+    # Tournaments (many sessions run as rooms, plus a final session)
+    def create_tournament(self, host_email: str, room_ids: List[str], schema_version: int = SCHEMA_V1) -> str:
+        tournament_id = str(uuid.uuid4())
+        # Room rows share the tournament partition, so they can be written in batches of 100
+        rooms = [
+            ("upsert", {"PartitionKey": tournament_id, "RowKey": f"rm:{sid}", "sessionId": sid, "room": idx + 1})
+            for idx, sid in enumerate(room_ids)
+        ]
+        try:
+            for start in range(0, len(rooms), 100):
+                self._client.submit_transaction(rooms[start:start + 100])
+            # Write meta last so a listed tournament always has its rooms
+            self._client.upsert_entity({
+                "PartitionKey": tournament_id,
+                "RowKey": "tournament",
+                "host": host_email.lower(),
+                "status": "rooms",
+                "roomStatus": "collecting",
+                "schemaVersion": int(schema_version),
+                "roomCount": len(room_ids),
+            })
+        except Exception:
+            # drop any rm: rows already written; the caller owns the room sessions
+            self.delete_session(tournament_id)
+            raise
+        return tournament_id
+
+    def get_tournament(self, tournament_id: str) -> Optional[Dict]:
+        try:
+            return self._client.get_entity(tournament_id, "tournament")
+        except Exception:
+            return None
+
+    def update_tournament(self, tournament_id: str, fields: Dict, etag: Optional[str] = None) -> bool:
+        """Merge fields into the tournament row; with etag, only if the row is unchanged (returns False otherwise)."""
+        entity = {"PartitionKey": tournament_id, "RowKey": "tournament", **fields}
+        if etag is None:
+            self._client.upsert_entity(entity)
+            return True
+        try:
+            self._client.update_entity(
+                entity, mode=UpdateMode.MERGE, etag=etag, match_condition=MatchConditions.IfNotModified
+            )
+        except ResourceModifiedError:
+            return False
+        return True
+
+    def list_tournament_rooms(self, tournament_id: str) -> List[Dict]:
+        rooms = self._list_prefix(tournament_id, "rm:")
+        return sorted(rooms, key=lambda r: int(r.get("room", 0)))
+
+    def update_tournament_room(self, tournament_id: str, session_id: str, fields: Dict) -> None:
+        entity = {"PartitionKey": tournament_id, "RowKey": f"rm:{session_id}", "sessionId": session_id, **fields}
+        self._client.upsert_entity(entity)
+
     # Statements
     def upsert_statements(self, session_id: str, email: str, truth1: str, truth2: str, lie1: str, alias: str) -> None:
+        if self._layout(session_id)[0] == SCHEMA_V2:
+            self._merge_player(session_id, email, {"alias": alias, "truth1": truth1, "truth2": truth2, "lie1": lie1})
+            return
         entity = {
             "PartitionKey": session_id,
             "RowKey": f"st:{email.lower()}",
@@ -109,6 +348,12 @@ class TableStorage:
         self._client.upsert_entity(entity)
 
     def list_statements(self, session_id: str) -> List[Dict]:
+        version, legacy = self._layout(session_id)
+        if version == SCHEMA_V2:
+            return [
+                self._statements_from_player(e) if e["RowKey"].startswith("pl:") else e
+                for e in self._merged_rows(session_id, "st:", "truth1", legacy)
+            ]
         # Use lexicographic range for RowKey prefix 'st:'
         return list(
             self._client.query_entities(
@@ -117,6 +362,16 @@ class TableStorage:
         )
 
     def get_statements(self, session_id: str, email: str) -> Optional[Dict]:
+        return self._get_statements(session_id, email, self._layout(session_id))
+
+    def _get_statements(self, session_id: str, email: str, layout: Tuple[int, bool]) -> Optional[Dict]:
+        version, legacy = layout
+        if version == SCHEMA_V2:
+            ent = self.get_player(session_id, email)
+            if ent and "truth1" in ent:
+                return self._statements_from_player(ent)
+            if not legacy:
+                return None
         try:
             return self._client.get_entity(session_id, f"st:{email.lower()}")
         except Exception:
@@ -124,13 +379,23 @@ class TableStorage:
 
     # Presentation (randomized order per target)
     def get_presentation(self, session_id: str, target_email: str) -> Optional[Dict]:
+        return self._get_presentation(session_id, target_email, self._layout(session_id))
+
+    def _get_presentation(self, session_id: str, target_email: str, layout: Tuple[int, bool]) -> Optional[Dict]:
+        version, legacy = layout
+        if version == SCHEMA_V2:
+            ent = self.get_player(session_id, target_email)
+            pr = self._presentation_from_player(ent) if ent else None
+            if pr or not legacy:
+                return pr
         try:
             return self._client.get_entity(session_id, f"pr:{target_email.lower()}")
         except Exception:
             return None
 
     def create_presentation(self, session_id: str, target_email: str) -> Dict:
-        st = self.get_statements(session_id, target_email)
+        layout = self._layout(session_id)
+        st = self._get_statements(session_id, target_email, layout)
         if not st:
             raise ValueError("No statements for target user")
 
@@ -143,6 +408,16 @@ class TableStorage:
         random.shuffle(items)
         order = ",".join(i["kind"] for i in items)
         lie_index = next((idx + 1 for idx, i in enumerate(items) if i["kind"] == "lie1"), 0)
+        if layout[0] == SCHEMA_V2:
+            perm = PRESENTATION_PERMUTATIONS.index(tuple(i["kind"] for i in items))
+            self._merge_player(session_id, target_email, {"perm": perm})
+            return {
+                "PartitionKey": session_id,
+                "RowKey": f"pr:{target_email.lower()}",
+                "target": target_email.lower(),
+                "order": order,
+                "lieIndex": lie_index,
+            }
         ent = {
             "PartitionKey": session_id,
             "RowKey": f"pr:{target_email.lower()}",
@@ -173,12 +448,19 @@ class TableStorage:
         )
 
     def tally_target(self, session_id: str, target_email: str) -> Dict:
-        pr = self.get_presentation(session_id, target_email)
+        """
+        Score the votes for a target. Voters already credited by an earlier tally are not
+        credited again; voters whose guess is no longer correct lose that point.
+        """
+        layout = self._layout(session_id)
+        pr = self._get_presentation(session_id, target_email, layout)
         if not pr:
             raise ValueError("Presentation not found; call create_presentation first")
         lie_index = int(pr.get("lieIndex", 0))
+        credited = {e for e in (pr.get("credited") or "").split(",") if e}
         votes = self.list_votes_for_target(session_id, target_email)
         results: List[Dict] = []
+        correct_now = set()
         for v in votes:
             correct = int(v.get("choice", 0)) == lie_index
             results.append({
@@ -187,14 +469,29 @@ class TableStorage:
                 "correct": correct,
             })
             if correct:
-                # increment score by 1
-                email = v.get("voter").lower()
-                cur = self.get_score(session_id, email)
-                self.upsert_score(session_id, email, cur + 1)
+                correct_now.add(v.get("voter").lower())
+        # Apply only the change since the last tally of this target
+        for email in sorted(correct_now ^ credited):
+            delta = 1 if email in correct_now else -1
+            cur = self._get_score(session_id, email, layout)
+            self._upsert_score(session_id, email, cur + delta, layout)
+        marker = {"credited": ",".join(sorted(correct_now))}
+        if layout[0] == SCHEMA_V2:
+            # Snapshot of received votes at tally time; cast_vote does not maintain it
+            histogram = {f"h{i}": sum(1 for r in results if r["choice"] == i) for i in (1, 2, 3)}
+            self._merge_player(session_id, target_email, {**marker, **histogram})
+        else:
+            self._client.upsert_entity({"PartitionKey": session_id, "RowKey": f"pr:{target_email.lower()}", **marker})
         return {"target": target_email.lower(), "lieIndex": lie_index, "results": results}
 
     # Scores
     def upsert_score(self, session_id: str, email: str, score: int) -> None:
+        self._upsert_score(session_id, email, score, self._layout(session_id))
+
+    def _upsert_score(self, session_id: str, email: str, score: int, layout: Tuple[int, bool]) -> None:
+        if layout[0] == SCHEMA_V2:
+            self._merge_player(session_id, email, {"score": int(score)})
+            return
         entity = {
             "PartitionKey": session_id,
             "RowKey": f"sc:{email.lower()}",
@@ -204,6 +501,16 @@ class TableStorage:
         self._client.upsert_entity(entity)
 
     def get_score(self, session_id: str, email: str) -> int:
+        return self._get_score(session_id, email, self._layout(session_id))
+
+    def _get_score(self, session_id: str, email: str, layout: Tuple[int, bool]) -> int:
+        version, legacy = layout
+        if version == SCHEMA_V2:
+            ent = self.get_player(session_id, email)
+            if ent and ent.get("score") is not None:
+                return int(ent["score"])
+            if not legacy:
+                return 0
         try:
             ent = self._client.get_entity(session_id, f"sc:{email.lower()}")
             return int(ent.get("score", 0))
@@ -211,6 +518,12 @@ class TableStorage:
             return 0
 
     def list_scores(self, session_id: str) -> List[Dict]:
+        version, legacy = self._layout(session_id)
+        if version == SCHEMA_V2:
+            return [
+                self._score_from_player(e) if e["RowKey"].startswith("pl:") else e
+                for e in self._merged_rows(session_id, "sc:", "score", legacy)
+            ]
         # Use lexicographic range for RowKey prefix 'sc:'
         return list(
             self._client.query_entities(
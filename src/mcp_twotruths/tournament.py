@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Tuple
+
+from .storage import SCHEMA_V1, TableStorage
+
+
+ROOM_STATUSES = ("collecting", "voting", "reveal", "ended")
+
+
+class TournamentRunner:
+    """
+    Runs many sessions ("rooms") side by side and a final round for the room winners.
+    Room fan-out (creation, status changes, tallies, winner collection) goes through a
+    bounded thread pool so 100+ rooms don't turn into 100+ sequential round trips or 100+
+    threads. tally_target is idempotent, so tallying rooms that were already revealed
+    target by target (or re-running after a partial failure) doesn't double-count.
+
+    The tournament row keeps "status" (rooms -> final) separate from "roomStatus",
+    the phase last applied to every room.
+    """
+
+    def __init__(self, storage: TableStorage, max_workers: int = 16) -> None:
+        self._storage = storage
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tt-rooms")
+
+    def _fan_out(self, fn: Callable[[Any], Any], items: List[Any]) -> Tuple[Dict[Any, Any], List[str]]:
+        """Run fn for every item concurrently; returns results by item and error strings."""
+        results: Dict[Any, Any] = {}
+        errors: List[str] = []
+        futures = {self._pool.submit(fn, item): item for item in items}
+        for fut in as_completed(futures):
+            item = futures[fut]
+            try:
+                results[item] = fut.result()
+            except Exception as e:
+                errors.append(f"{item}: {e}")
+        return results, errors
+
+    def _require(self, tournament_id: str) -> Dict:
+        meta = self._storage.get_tournament(tournament_id)
+        if not meta:
+            raise ValueError("Tournament not found")
+        return meta
+
+    def _room_ids(self, tournament_id: str) -> List[str]:
+        return [r["sessionId"] for r in self._storage.list_tournament_rooms(tournament_id)]
+
+    def create(self, host_email: str, room_count: int, schema_version: int = SCHEMA_V1) -> Dict:
+        """Create room_count sessions and the tournament; if any room fails, the created ones are deleted."""
+        labels = [f"room {i + 1}" for i in range(room_count)]
+        results, errors = self._fan_out(
+            lambda _: self._storage.create_session(host_email, schema_version), labels
+        )
+        if not errors:
+            room_ids = [results[label] for label in labels]
+            try:
+                tournament_id = self._storage.create_tournament(host_email, room_ids, schema_version)
+            except Exception as e:
+                errors.append(f"tournament: {e}")
+        if errors:
+            _, cleanup_errors = self._fan_out(self._storage.delete_session, list(results.values()))
+            return {"tournamentId": None, "rooms": [], "errors": errors + cleanup_errors}
+        return {"tournamentId": tournament_id, "status": "rooms", "roomStatus": "collecting", "rooms": room_ids, "errors": []}
+
+    def set_status(self, tournament_id: str, status: str) -> Dict:
+        """Apply a phase change to every room (the final session is driven on its own)."""
+        if status not in ROOM_STATUSES:
+            raise ValueError(f"status must be one of {'|'.join(ROOM_STATUSES)}")
+        self._require(tournament_id)
+
+        def apply(sid: str) -> Dict:
+            self._storage.set_session_status(sid, status)
+            return {"status": status}
+
+        results, errors = self._fan_out(apply, self._room_ids(tournament_id))
+        # roomStatus means every room has this phase; on partial failure leave it and report errors
+        if not errors:
+            self._storage.update_tournament(tournament_id, {"roomStatus": status})
+        return {"tournamentId": tournament_id, "roomStatus": status, "updated": len(results), "errors": errors}
+
+    def _record_winners(self, tournament_id: str, session_id: str) -> Dict:
+        scores = [(s.get("email", "").lower(), int(s.get("score", 0))) for s in self._storage.list_scores(session_id)]
+        top = max((score for _, score in scores), default=0)
+        winners = sorted(email for email, score in scores if score == top and top > 0)
+        self._storage.update_tournament_room(tournament_id, session_id, {"winners": ",".join(winners), "topScore": top})
+        return {"winners": winners, "topScore": top}
+
+    def _tally_room(self, session_id: str) -> int:
+        # Targets are tallied one after another: each tally read-modify-writes voter scores,
+        # so only rooms (separate partitions) are processed in parallel.
+        tallied = 0
+        for st in self._storage.list_statements(session_id):
+            target = (st.get("email") or "").lower()
+            try:
+                self._storage.tally_target(session_id, target)
+            except ValueError:
+                # no presentation yet for this target
+                continue
+            tallied += 1
+        return tallied
+
+    def tally(self, tournament_id: str) -> Dict:
+        """Tally every presented target in every room, then record each room's winners."""
+        self._require(tournament_id)
+        room_ids = self._room_ids(tournament_id)
+
+        def tally_and_record(sid: str) -> Dict:
+            tallied = self._tally_room(sid)
+            return {"tallied": tallied, **self._record_winners(tournament_id, sid)}
+
+        results, errors = self._fan_out(tally_and_record, room_ids)
+        rooms = [{"sessionId": sid, **results[sid]} for sid in room_ids if sid in results]
+        return {"tournamentId": tournament_id, "rooms": rooms, "errors": errors}
+
+    def collect_winners(self, tournament_id: str) -> Dict:
+        """
+        Read every room's scores and record its winners (all players tied on the top score),
+        for rooms that were already tallied target by target. Scores are not changed.
+        """
+        self._require(tournament_id)
+        room_ids = self._room_ids(tournament_id)
+
+        results, errors = self._fan_out(lambda sid: self._record_winners(tournament_id, sid), room_ids)
+        rooms = [{"sessionId": sid, **results[sid]} for sid in room_ids if sid in results]
+        return {"tournamentId": tournament_id, "rooms": rooms, "errors": errors}
+
+    def create_final(self, tournament_id: str) -> Dict:
+        meta = self._require(tournament_id)
+        if meta.get("finalSessionId"):
+            raise ValueError("Final session already created")
+        finalists: List[str] = []
+        pending: List[str] = []
+        for room in self._storage.list_tournament_rooms(tournament_id):
+            if room.get("winners") is None:
+                pending.append(room["sessionId"])
+                continue
+            finalists.extend(w for w in room["winners"].split(",") if w and w not in finalists)
+        if not finalists:
+            raise ValueError("No room winners yet; tally the rooms first")
+        final_id = self._storage.create_session(meta["host"], int(meta.get("schemaVersion", SCHEMA_V1)))
+        # Conditional on the row we read, so concurrent calls can't both attach a final
+        if not self._storage.update_tournament(
+            tournament_id, {"finalSessionId": final_id, "status": "final"}, etag=meta.metadata["etag"]
+        ):
+            self._storage.delete_session(final_id)
+            current = self._require(tournament_id)
+            if current.get("finalSessionId"):
+                raise ValueError("Final session already created")
+            raise ValueError("Tournament changed while creating the final; try again")
+        return {"tournamentId": tournament_id, "finalSessionId": final_id, "finalists": finalists, "pendingRooms": pending}
+
+    def bracket(self, tournament_id: str) -> Dict:
+        meta = self._require(tournament_id)
+        rooms = [
+            {
+                "room": int(r.get("room", 0)),
+                "sessionId": r["sessionId"],
+                "winners": [w for w in (r.get("winners") or "").split(",") if w],
+                "topScore": int(r.get("topScore", 0)),
+            }
+            for r in self._storage.list_tournament_rooms(tournament_id)
+        ]
+        final_id = meta.get("finalSessionId")
+        final = None
+        if final_id:
+            scores = sorted(
+                ({"email": s.get("email"), "score": int(s.get("score", 0))} for s in self._storage.list_scores(final_id)),
+                key=lambda s: -s["score"],
+            )
+            final = {"sessionId": final_id, "scores": scores}
+        return {
+            "tournamentId": tournament_id,
+            "status": meta.get("status"),
+            "roomStatus": meta.get("roomStatus"),
+            "rooms": rooms,
+            "final": final,
+        }